@@ -1,15 +1,21 @@
 """A proxy server and logging functions."""
 import argparse
 import logging
+import os
 import re
+import selectors
 import signal
 import socket
 import json
 import urllib
 import sys
-import time
 import threading
 
+# os.splice is only available on Linux with Python 3.10+.
+SPLICE_AVAILABLE = hasattr(os, 'splice')
+if SPLICE_AVAILABLE:
+    import fcntl
+
 
 def setup_logging():
     """Initialize logging to file and console."""
@@ -30,6 +36,76 @@ def setup_logging():
     logger.addHandler(f_handler)
     return logger
 
+def tunnel_selector(client_sock, server_sock):
+    """Return a selector waiting for either socket of a tunnel to become readable.
+
+    Each socket is registered with its peer as data. The default selector
+    (epoll on Linux) has no limit on descriptor numbers, unlike select.select.
+    """
+    selector = selectors.DefaultSelector()
+    selector.register(client_sock, selectors.EVENT_READ, server_sock)
+    selector.register(server_sock, selectors.EVENT_READ, client_sock)
+    return selector
+
+def relay_tunnel(client_sock, server_sock, chunk_size):
+    """Relay bytes in both directions between two sockets until either side closes.
+
+    Data is copied through userspace with recv/sendall.
+    ## Parameters:
+    client_sock - A socket object connected to the client
+    server_sock - A socket object connected to the web server
+    chunk_size - Maximum number of bytes to read at once
+    ## Returns:
+    None
+    """
+    client_sock.setblocking(True)
+    server_sock.setblocking(True)
+    with tunnel_selector(client_sock, server_sock) as selector:
+        while True:
+            for key, _ in selector.select():
+                data = key.fileobj.recv(chunk_size)
+                if not data:
+                    return
+                key.data.sendall(data)
+
+
+def splice_tunnel(client_sock, server_sock, chunk_size):
+    """Relay bytes in both directions between two sockets until either side closes.
+
+    Data is moved socket-to-pipe-to-socket with os.splice, so it never leaves
+    the kernel. Only available on Linux, see SPLICE_AVAILABLE.
+    ## Parameters:
+    client_sock - A socket object connected to the client
+    server_sock - A socket object connected to the web server
+    chunk_size - Maximum number of bytes to move at once, pipes are grown to fit where allowed
+    ## Returns:
+    None
+    """
+    pipes = {sock: os.pipe() for sock in (client_sock, server_sock)}
+    for _, pipe_write in pipes.values():
+        try:
+            # Larger pipes mean fewer splice calls per byte, the default is 64KB.
+            fcntl.fcntl(pipe_write, fcntl.F_SETPIPE_SZ, chunk_size)
+        except (AttributeError, OSError):
+            pass
+    client_sock.setblocking(True)
+    server_sock.setblocking(True)
+    try:
+        with tunnel_selector(client_sock, server_sock) as selector:
+            while True:
+                for key, _ in selector.select():
+                    pipe_read, pipe_write = pipes[key.fileobj]
+                    pending = os.splice(key.fileobj.fileno(), pipe_write, chunk_size, flags=os.SPLICE_F_MOVE)
+                    if pending == 0:
+                        return
+                    while pending:
+                        pending -= os.splice(pipe_read, key.data.fileno(), pending, flags=os.SPLICE_F_MOVE)
+    finally:
+        for pipe_read, pipe_write in pipes.values():
+            os.close(pipe_read)
+            os.close(pipe_write)
+
+
 class proxy_server:
     """A proxy server for http/https connections."""
 
@@ -44,6 +120,8 @@ class proxy_server:
         self.CONNECTION_TIMEOUT = 10
         self.CACHE = {}
         self.USE_CACHE = False # A flag for whether or not to use the cache
+        self.USE_SPLICE = SPLICE_AVAILABLE # A flag for relaying https tunnels with os.splice
+        self.TUNNEL_CHUNK_LEN = 262144 # Bytes moved per splice call
         # Logging
         self.logger = setup_logging()
         # Setting up the socket for the server to listen on
@@ -139,28 +217,20 @@ class proxy_server:
                 if is_not_blocked and self.is_https_request(request['request']):
                     self.logger.info("https request: {}".format(request['request']))
                     tmp_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM) 
-                    tmp_socket.connect((request['url'], request['port']))
-                    reply = "HTTP/1.0 200 Connection established\r\n"
-                    reply += "Proxy-agent: Pyx\r\n"
-                    reply += "\r\n"
-                    conn.sendall(reply.encode())
-                    conn.setblocking(0)
-                    tmp_socket.setblocking(0)
-                    while True:
-                        try:
-                            request = conn.recv(self.MAX_REQ_LEN)
-                            tmp_socket.sendall(request)
-                        except socket.error as err:
-                            pass
-                        except BlockingIOError as err:
-                            time.sleep(0.1)
-                        try:
-                            reply = tmp_socket.recv(self.MAX_REQ_LEN)
-                            conn.sendall(reply)
-                        except socket.error as err:
-                            pass
-                        except BlockingIOError as err:
-                            time.sleep(0.1)
+                    try:
+                        tmp_socket.connect((request['url'], request['port']))
+                        reply = "HTTP/1.0 200 Connection established\r\n"
+                        reply += "Proxy-agent: Pyx\r\n"
+                        reply += "\r\n"
+                        conn.sendall(reply.encode())
+                        # The proxy never reads the encrypted payload, so relay it without copying when possible.
+                        if self.USE_SPLICE:
+                            splice_tunnel(conn, tmp_socket, self.TUNNEL_CHUNK_LEN)
+                        else:
+                            relay_tunnel(conn, tmp_socket, self.MAX_REQ_LEN)
+                    finally:
+                        # Reset or broken connections raise out of the relay, close upstream regardless.
+                        tmp_socket.close()
 
                 elif is_not_blocked: # It is a http request
                     # Check cache
@@ -0,0 +1,106 @@
+"""Benchmark bulk throughput and CPU cost of the proxy's https tunnel relays.
+
+Pushes a fixed amount of data from a local source socket, through a relay,
+to a local sink socket, once with the recv/sendall relay and once with the
+os.splice relay, and reports throughput and relay CPU seconds per GiB.
+"""
+import argparse
+import json
+import socket
+import threading
+import time
+
+from proxy_server import SPLICE_AVAILABLE, relay_tunnel, splice_tunnel
+
+
+def connected_pair(listener):
+    """Return a (connecting, accepted) pair of TCP sockets through the listener."""
+    outgoing = socket.create_connection(listener.getsockname())
+    incoming, _ = listener.accept()
+    return outgoing, incoming
+
+
+def run_relay(relay, chunk_size, total_bytes):
+    """Push total_bytes through the relay, return wall and relay thread CPU seconds."""
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(2)
+    # source -> relay_client_side ... relay_server_side -> sink
+    source, relay_client_side = connected_pair(listener)
+    relay_server_side, sink = connected_pair(listener)
+    listener.close()
+
+    cpu_time = {}
+    received = [0]
+
+    def relay_thread():
+        start = time.thread_time()
+        relay(relay_client_side, relay_server_side, chunk_size)
+        cpu_time['relay'] = time.thread_time() - start
+        relay_client_side.close()
+        relay_server_side.close()
+
+    def sink_thread():
+        while True:
+            data = sink.recv(1024 * 1024)
+            if not data:
+                break
+            received[0] += len(data)
+
+    threads = [threading.Thread(target=relay_thread), threading.Thread(target=sink_thread)]
+    payload = b'\x00' * (1024 * 1024)
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    sent = 0
+    while sent < total_bytes:
+        source.sendall(payload[:total_bytes - sent])
+        sent += min(len(payload), total_bytes - sent)
+    source.close()
+    for thread in threads:
+        thread.join()
+    wall_time = time.perf_counter() - start
+    sink.close()
+    if received[0] != total_bytes:
+        raise RuntimeError("Relay delivered {0} of {1} bytes.".format(received[0], total_bytes))
+    return wall_time, cpu_time['relay']
+
+
+def benchmark(name, relay, chunk_size, total_bytes, repeats):
+    """Run a relay repeats times and summarise the best run."""
+    runs = [run_relay(relay, chunk_size, total_bytes) for _ in range(repeats)]
+    wall_time, cpu_time = min(runs)
+    gibibytes = total_bytes / 2**30
+    return {
+        'relay': name,
+        'chunk_size': chunk_size,
+        'bytes': total_bytes,
+        'wall_s': wall_time,
+        'throughput_mib_s': total_bytes / 2**20 / wall_time,
+        'relay_cpu_s_per_gib': cpu_time / gibibytes,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-m", "--mebibytes", type=int, default=1024, help="MiB pushed through each relay per run.")
+    parser.add_argument("-r", "--repeats", type=int, default=3, help="Runs per relay, the fastest is reported.")
+    parser.add_argument("-o", "--output", default=None, help="File to write JSON results to, defaults to stdout.")
+    args = parser.parse_args()
+    total_bytes = args.mebibytes * 2**20
+    # 4096 is the proxy's MAX_REQ_LEN, 262144 its TUNNEL_CHUNK_LEN.
+    results = [
+        benchmark('recv/sendall', relay_tunnel, 4096, total_bytes, args.repeats),
+        benchmark('recv/sendall', relay_tunnel, 262144, total_bytes, args.repeats),
+    ]
+    if SPLICE_AVAILABLE:
+        results.append(benchmark('splice', splice_tunnel, 65536, total_bytes, args.repeats))
+        results.append(benchmark('splice', splice_tunnel, 262144, total_bytes, args.repeats))
+    else:
+        print("os.splice is not available on this platform, skipping splice relay.")
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+        print("Results written to {0}".format(args.output))
+    else:
+        print(json.dumps(results, indent=2))
@@ -1,15 +1,33 @@
 """Messaging application server."""
 from flask import Flask, request, render_template, redirect, make_response, jsonify
-from typing import List, Dict
 import json
 import datetime
+import gzip
 import jwt
 import os
 
+from search_index import search_index
+from storage import open_store
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
 app = Flask(__name__)
+app.config['MAX_CONTENT_LENGTH'] = int(os.getenv('MAX_CONTENT_LENGTH', 1024 * 1024))
+
+# Responses smaller than this are sent uncompressed.
+MIN_COMPRESS_SIZE = int(os.getenv('MIN_COMPRESS_SIZE', 1024))
 
-user_database: Dict[str, Dict[str, str]] = {}
-message_database: List[str] = []  
+store = open_store()
+# Built from the stored messages at startup (by __main__ below, or by serve.py
+# once before forking workers), then caught up with new messages before every search.
+message_index = search_index()
+# Rendered (and compressed) message listings, keyed by (format, accepted encoding).
+# Each entry holds the latest message id it was rendered at, the body and the
+# encoding actually applied, and is replaced as soon as a new message arrives.
+message_page_cache = {}
 
 @app.route('/', methods=['GET'])
 def index():
@@ -32,7 +50,7 @@ def login():
         user_email = post_data.get('email')
         user = check_for_user(user_email)
         if user:
-            auth_token = encode_auth_token(user_database[user_email]['id'])
+            auth_token = encode_auth_token(user['id'])
             if auth_token:
                 responseObject = {
                     'status': 'success',
@@ -72,10 +90,10 @@ def register():
         try:
             username = post_data.get('username')
             user_email = post_data.get('email')
-            # insert the user to user_database
-            add_user(user_email, username)
+            # insert the user to the user database
+            user_id = add_user(user_email, username)
             # generate the auth token
-            auth_token = encode_auth_token(user_database[user_email]['id'])
+            auth_token = encode_auth_token(user_id)
             responseObject = {
                 'status': 'success',
                 'message': 'Successfully registered.',
@@ -97,7 +115,7 @@ def register():
 
 @app.route('/messages', methods=['POST'])
 def add_message():
-    """Add a message to the message_database."""
+    """Add a message to the message database."""
     req_data = request.get_json()
 
     # Error checking req_data
@@ -117,10 +135,34 @@ def add_message():
         return make_response(jsonify(responseObject)), 401
 
     message = req_data['message']
-    message_database.append(message)
+    store.add_message(message)
     print("Recieved message: '{0}' and added it to message database.".format(message))
     return redirect('/')
-    
+
+@app.route('/messages/batch', methods=['POST'])
+def add_messages():
+    """Add a list of messages to the message database, return their ids."""
+    req_data = request.get_json()
+
+    # Error checking req_data
+    if not req_data or 'auth_token' not in req_data:
+        responseObject = {'status': 'fail','message': 'No auth token found, please log in first.'}
+        return make_response(jsonify(responseObject)), 401
+    messages = req_data.get('messages')
+    if not isinstance(messages, list) or not all(isinstance(message, str) for message in messages):
+        responseObject = {'status': 'fail','message': 'No messages found, please supply a list of messages.'}
+        return make_response(jsonify(responseObject)), 400
+
+    resp = decode_auth_token(req_data['auth_token'])
+
+    # Check auth token is valid
+    if isinstance(resp, str):
+        responseObject = {'status': 'fail','message': resp}
+        return make_response(jsonify(responseObject)), 401
+
+    ids = store.add_messages(messages)
+    return make_response(jsonify({'status': 'success', 'ids': ids})), 201
+
 
 @app.route('/allmessages', methods=['GET'])
 def get_messages():
@@ -130,8 +172,7 @@ def get_messages():
         auth_token = req_data['auth_token']
         resp = decode_auth_token(auth_token)
         if not isinstance(resp, str):
-            database_dump = ''.join(message_database)
-            return render_template("index.html", message="All messages:"+database_dump)
+            return message_listing_response()
         responseObject = {
             'status': 'fail',
             'message': resp
@@ -145,27 +186,109 @@ def get_messages():
         return make_response(jsonify(responseObject)), 401
     
 
+@app.route('/search', methods=['GET'])
+def search_messages():
+    """Search messages, e.g. /search?q=hello+"good+morning"&page=1&per_page=20."""
+    req_data = request.get_json()
+    if not req_data or 'auth_token' not in req_data:
+        responseObject = {'status': 'fail','message': 'No auth token found, please log in first.'}
+        return make_response(jsonify(responseObject)), 401
+    resp = decode_auth_token(req_data['auth_token'])
+    if isinstance(resp, str):
+        responseObject = {'status': 'fail','message': resp}
+        return make_response(jsonify(responseObject)), 401
+
+    query = request.args.get('q', '')
+    page = request.args.get('page', 1, type=int)
+    per_page = request.args.get('per_page', 20, type=int)
+    if not query.strip() or page < 1 or not 1 <= per_page <= 100:
+        responseObject = {'status': 'fail','message': 'Please supply a query, a page of at least 1 and per_page between 1 and 100.'}
+        return make_response(jsonify(responseObject)), 400
+
+    # Index messages stored (by any worker) since the last search.
+    message_index.catch_up(store)
+    results, has_more = message_index.search(query, store, offset=(page - 1) * per_page, limit=per_page)
+    responseObject = {
+        'status': 'success',
+        'page': page,
+        'per_page': per_page,
+        'has_more': has_more,
+        'results': [{'id': message_id, 'message': message} for message_id, message in results]
+    }
+    return make_response(jsonify(responseObject)), 200
+
+
+def message_listing_response():
+    """Return the message listing, or 304 if the client's copy is current.
+
+    The ETag is the id of the latest message, so a poll with a matching
+    If-None-Match header costs a single id lookup. Pass ?format=json or
+    Accept: application/json for a JSON listing instead of HTML.
+    """
+    latest_id = store.latest_message_id()
+    if request.args.get('format') == 'json':
+        fmt = 'json'
+    else:
+        fmt = 'json' if request.accept_mimetypes.best_match(['text/html', 'application/json']) == 'application/json' else 'html'
+    etag = '{0}-{1}'.format(fmt, latest_id)
+
+    if request.if_none_match.contains_weak(etag):
+        response = make_response('', 304)
+    else:
+        accepted_encoding = choose_encoding()
+        cached = message_page_cache.get((fmt, accepted_encoding))
+        if cached and cached[0] == latest_id:
+            _, body, encoding = cached
+        else:
+            body, encoding = render_message_listing(fmt, accepted_encoding)
+            message_page_cache[(fmt, accepted_encoding)] = (latest_id, body, encoding)
+        response = make_response(body, 200)
+        response.mimetype = 'application/json' if fmt == 'json' else 'text/html'
+        # Small bodies are sent uncompressed even when the client accepts an encoding.
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+    # Weak, since the gzip/brotli/identity bodies share a tag.
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.vary.update(('Accept', 'Accept-Encoding'))
+    return response
+
+
+def choose_encoding():
+    """Return the best compression the client accepts ('br', 'gzip') or None."""
+    if brotli is not None and request.accept_encodings['br']:
+        return 'br'
+    if request.accept_encodings['gzip']:
+        return 'gzip'
+    return None
+
+
+def render_message_listing(fmt, encoding):
+    """Render every stored message as HTML or JSON, compressing large bodies.
+
+    Return the body and the encoding actually applied, None if uncompressed.
+    """
+    messages = store.all_messages()
+    if fmt == 'json':
+        body = json.dumps({'status': 'success', 'messages': messages}, separators=(',', ':'))
+    else:
+        body = render_template("index.html", message="All messages:"+''.join(messages))
+    body = body.encode('utf-8')
+    if encoding is None or len(body) < MIN_COMPRESS_SIZE:
+        return body, None
+    if encoding == 'br':
+        return brotli.compress(body), 'br'
+    return gzip.compress(body, compresslevel=6), 'gzip'
+
+
 def add_user(email, username):
-    """Add a user to the user database."""
-    # Find max user id
-    max_id = 0
-    for tmp_email in user_database:
-        if user_database[tmp_email]['id'] > max_id:
-            max_id = user_database[tmp_email]['id']
-    
-    # Add user to database
-    tmp_dict: Dict[str, str] = {}
-    tmp_dict['id'] = max_id + 1
-    tmp_dict['username'] = username
-    user_database[email] = tmp_dict
+    """Add a user to the user database, return the new user id."""
+    return store.add_user(email, username)
 
 
 def check_for_user(email):
     """Check user database for a particular email, if found return associated username."""
-    if email in user_database:
-        return user_database[email]
-    else:
-        return None
+    return store.get_user(email)
 
 def encode_auth_token(user_id):
     """Generate the Auth Token.
@@ -203,4 +326,8 @@ def decode_auth_token(auth_token):
         return 'Invalid token. Please log in again.'
 
 if __name__ == "__main__":
+    # The debug reloader re-runs this module in the child process that serves
+    # requests, so only build the search index there.
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        message_index.catch_up(store)
     app.run(debug=True)
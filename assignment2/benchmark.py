@@ -0,0 +1,317 @@
+"""Load-test and latency benchmark for the messaging application server.
+
+Starts app.py (or serve.py) as a separate process on a free local port,
+registers synthetic users and drives a mix of register, login, post and fetch
+requests at a target concurrency. Throughput, latency percentiles and the
+server's memory growth per 100k stored messages are written as JSON.
+Everything runs on 127.0.0.1, so results can be compared between storage
+backends offline, e.g.
+
+    python benchmark.py --store memory --output memory.json
+    python benchmark.py --store sqlite --output sqlite.json
+    python benchmark.py --server serve --store sqlite --workers 4 --output serve.json
+"""
+import argparse
+import itertools
+import json
+import logging
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from client import client
+
+OPERATIONS = ['register', 'login', 'post', 'fetch']
+# Messages posted per request while measuring memory growth.
+MEMORY_BATCH_SIZE = 1000
+
+
+def process_rss(pid):
+    """Return the resident set size in bytes of a process and its children.
+
+    Reads /proc, so returns None on platforms without it.
+    """
+    try:
+        with open('/proc/{0}/status'.format(pid)) as status:
+            rss = next(int(line.split()[1]) * 1024 for line in status if line.startswith('VmRSS:'))
+        children = []
+        for task in os.listdir('/proc/{0}/task'.format(pid)):
+            with open('/proc/{0}/task/{1}/children'.format(pid, task)) as task_children:
+                children.extend(int(child) for child in task_children.read().split())
+    except (OSError, StopIteration):
+        return None
+    for child in children:
+        child_rss = process_rss(child)
+        if child_rss:
+            rss += child_rss
+    return rss
+
+
+def percentile(sorted_values, fraction):
+    """Return the value at the given fraction (0-1) of an already sorted list."""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def parse_mix(mix):
+    """Parse a traffic mix such as 'register=1,login=2,post=5,fetch=2' into a dict of weights."""
+    weights = {}
+    for part in mix.split(','):
+        name, _, weight = part.partition('=')
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError("Unknown operation '{0}' in mix.".format(name))
+        weights[name] = float(weight)
+    return weights
+
+
+def free_port():
+    """Return a local TCP port that is currently free."""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def run_app(port):
+    """Serve app.py on the given port, run as the benchmark's server process."""
+    # Per-request access logs would only slow the server down.
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    from app import app, message_index, store
+    message_index.catch_up(store)
+    app.run(host='127.0.0.1', port=port, threaded=True)
+
+
+def start_server(args, db_path, port):
+    """Start the server under test as a separate process, return the Popen object.
+
+    The server's output is discarded, app.py prints a line for every message.
+    """
+    env = dict(os.environ, MESSAGE_STORE=args.store, DATABASE_PATH=db_path)
+    here = os.path.dirname(os.path.abspath(__file__))
+    if args.server == 'serve':
+        command = [sys.executable, os.path.join(here, 'serve.py'), '-p', str(port),
+                   '-w', str(args.workers), '--db_path', db_path]
+    else:
+        command = [sys.executable, os.path.abspath(__file__), '--run_app', str(port)]
+    return subprocess.Popen(command, cwd=here, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def wait_for_server(bench_client, server, timeout=30):
+    """Ping the server until it answers, raising if it exits or times out first."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError("Server exited with code {0} before it started.".format(server.returncode))
+        try:
+            if bench_client.ping().status_code == 200:
+                return
+        except Exception:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError("Server did not start within {0} seconds.".format(timeout))
+
+
+def stop_server(server):
+    """Terminate the server process, killing it if it does not exit."""
+    server.terminate()
+    try:
+        server.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        server.kill()
+        server.wait()
+
+
+class load_driver:
+    """Issue benchmark requests and record their latencies."""
+
+    def __init__(self, bench_client):
+        """Initialize with a non-interactive client pointed at the server."""
+        self.client = bench_client
+        self.users = []
+        self.user_counter = itertools.count()
+        self.latencies = {name: [] for name in OPERATIONS}
+        self.errors = {name: 0 for name in OPERATIONS}
+        self.messages_stored = 0
+        self.lock = threading.Lock()
+
+    def register(self):
+        """Register a new synthetic user."""
+        email = 'bench{0}@example.com'.format(next(self.user_counter))
+        raw_response = self.client.register(email, email.split('@')[0])
+        if raw_response.status_code == 201:
+            with self.lock:
+                self.users.append((email, raw_response.json()['auth_token']))
+        return raw_response
+
+    def login(self):
+        """Log in as a random existing user."""
+        email, _ = random.choice(self.users)
+        return self.client.login(email)
+
+    def post(self):
+        """Post a message as a random existing user."""
+        _, auth_token = random.choice(self.users)
+        message = 'benchmark message {0} '.format(random.getrandbits(32))
+        raw_response = self.client.send_message(message, auth_token=auth_token)
+        # app.py redirects to the landing page after storing a message.
+        if raw_response.status_code == 200:
+            with self.lock:
+                self.messages_stored += 1
+        return raw_response
+
+    def fetch(self):
+        """Fetch all messages as a random existing user."""
+        _, auth_token = random.choice(self.users)
+        return self.client.fetch_messages(auth_token=auth_token)
+
+    def run_operation(self, name):
+        """Run and time one operation, recording an error for failed requests."""
+        start = time.perf_counter()
+        try:
+            ok = getattr(self, name)().status_code < 400
+        except Exception:
+            ok = False
+        elapsed = time.perf_counter() - start
+        with self.lock:
+            self.latencies[name].append(elapsed)
+            if not ok:
+                self.errors[name] += 1
+
+
+def summarise(latencies, errors):
+    """Return count, error and latency statistics (in milliseconds) for a list of latencies."""
+    latencies = sorted(latencies)
+    summary = {'count': len(latencies), 'errors': errors}
+    if latencies:
+        summary['mean_ms'] = sum(latencies) / len(latencies) * 1000
+        summary['p50_ms'] = percentile(latencies, 0.50) * 1000
+        summary['p99_ms'] = percentile(latencies, 0.99) * 1000
+        summary['max_ms'] = latencies[-1] * 1000
+    return summary
+
+
+def run_benchmark(args):
+    """Run the benchmark described by the parsed arguments, return the results dict.
+
+    Without --db_path the sqlite database lives in a temporary directory
+    that is removed once the run is over.
+    """
+    if args.db_path:
+        return drive_benchmark(args, args.db_path)
+    with tempfile.TemporaryDirectory(prefix='tele-koms-bench-') as db_dir:
+        return drive_benchmark(args, os.path.join(db_dir, 'messages.db'))
+
+
+def drive_benchmark(args, db_path):
+    """Start the server on db_path, run the timed load and the memory run, return the results dict."""
+    random.seed(args.seed)
+    port = free_port()
+    server = start_server(args, db_path, port)
+    bench_client = client(port, INTERACTIVE=False, MAX_WORKERS=args.concurrency)
+    try:
+        wait_for_server(bench_client, server)
+        driver = load_driver(bench_client)
+
+        # Register the initial users one at a time, these are not part of the timed run.
+        for _ in range(args.users):
+            driver.register()
+        driver.latencies['register'].clear()
+        if not driver.users:
+            raise RuntimeError("Unable to register any users with the server.")
+
+        weights = parse_mix(args.mix)
+        names = list(weights)
+        operations = random.choices(names, weights=[weights[name] for name in names], k=args.requests)
+
+        start = time.perf_counter()
+        futures = [bench_client.submit(driver.run_operation, name) for name in operations]
+        for future in futures:
+            future.result()
+        duration = time.perf_counter() - start
+
+        # Memory is measured separately, by storing a fixed number of messages in batches.
+        rss_before = process_rss(server.pid)
+        memory_messages = store_messages(bench_client, driver.users[0][1], args.memory_messages)
+        rss_after = process_rss(server.pid)
+    finally:
+        bench_client.close()
+        stop_server(server)
+
+    all_latencies = list(itertools.chain.from_iterable(driver.latencies.values()))
+    results = {
+        'config': {
+            'server': args.server,
+            'workers': args.workers if args.server == 'serve' else 1,
+            'store': args.store,
+            'users': args.users,
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+            'mix': weights,
+            'seed': args.seed,
+        },
+        'duration_s': duration,
+        'throughput_rps': len(all_latencies) / duration if duration else None,
+        'overall': summarise(all_latencies, sum(driver.errors.values())),
+        'operations': {name: summarise(driver.latencies[name], driver.errors[name]) for name in names},
+        'messages_stored': driver.messages_stored,
+        'memory': {
+            'messages_stored': memory_messages,
+            'server_rss_before_bytes': rss_before,
+            'server_rss_after_bytes': rss_after,
+            'server_rss_growth_per_100k_messages_bytes':
+                (rss_after - rss_before) / memory_messages * 100000
+                if memory_messages and rss_before is not None and rss_after is not None else None,
+        },
+    }
+    return results
+
+
+def store_messages(bench_client, auth_token, count):
+    """Store count messages through the batch endpoint, return how many were stored."""
+    stored = 0
+    while stored < count:
+        batch = ['memory message {0} {1}'.format(stored + i, random.getrandbits(32))
+                 for i in range(min(MEMORY_BATCH_SIZE, count - stored))]
+        raw_response = bench_client.send_messages(batch, auth_token=auth_token)
+        if raw_response.status_code != 201:
+            raise RuntimeError("Batch of messages rejected with status {0}.".format(raw_response.status_code))
+        stored += len(batch)
+    return stored
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--run_app", type=int, default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--server", choices=['app', 'serve'], default='app',
+                        help="Run the single process app.py server or the multi-worker serve.py server.")
+    parser.add_argument("-w", "--workers", type=int, default=4, help="Worker processes for the serve.py server.")
+    parser.add_argument("-s", "--store", choices=['memory', 'sqlite'], default='memory', help="Storage backend to benchmark.")
+    parser.add_argument("--db_path", default=None, help="SQLite database file, defaults to a temporary file.")
+    parser.add_argument("-u", "--users", type=int, default=100, help="Number of synthetic users to register up front.")
+    parser.add_argument("-n", "--requests", type=int, default=10000, help="Number of requests in the timed run.")
+    parser.add_argument("-c", "--concurrency", type=int, default=16, help="Number of requests in flight at once.")
+    parser.add_argument("-m", "--mix", default='register=1,login=2,post=5,fetch=2',
+                        help="Relative weights of each operation in the timed run.")
+    parser.add_argument("--memory_messages", type=int, default=100000,
+                        help="Messages stored after the timed run to measure server memory growth.")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for the traffic mix.")
+    parser.add_argument("-o", "--output", default=None, help="File to write JSON results to, defaults to stdout.")
+    args = parser.parse_args()
+    if args.run_app is not None:
+        run_app(args.run_app)
+        sys.exit(0)
+    if args.server == 'serve' and args.store != 'sqlite':
+        parser.error("serve.py workers can only share the sqlite store.")
+    results = run_benchmark(args)
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+        print("Results written to {0}".format(args.output))
+    else:
+        print(json.dumps(results, indent=2))
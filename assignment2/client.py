@@ -4,7 +4,10 @@ import signal
 import sys
 import json
 import threading
+from concurrent.futures import ThreadPoolExecutor
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 exit_program = False
 
@@ -12,14 +15,38 @@ class client:
     """Client for communicating with secure social media application server."""
     auth_token = ""
 
-    def __init__(self, PORT=5000):
-        """Start the client, with an optional argument for setting the port of the server."""
+    def __init__(self, PORT=5000, BATCH_SIZE=50, INTERACTIVE=True, MAX_WORKERS=10, TIMEOUT=10, RETRIES=3):
+        """Start the client.
+
+        ## Parameters:
+        PORT - Port of the server.
+        BATCH_SIZE - Number of queued messages sent per batch.
+        INTERACTIVE - Whether to start the user input thread, pass False to script the client.
+        MAX_WORKERS - Number of threads (and pooled connections) used for concurrent requests.
+        TIMEOUT - Seconds to wait for the server to connect or respond.
+        RETRIES - Number of times to retry failed connections.
+        """
         self.server_port = PORT
+        self.batch_size = BATCH_SIZE
+        self.timeout = TIMEOUT
+        self.message_queue = []
+        # (ETag, body) of the last listing received, replaced as one value so
+        # concurrent fetches never pair an ETag with another fetch's body.
+        self.message_listing = (None, "")
         self.local_route = 'http://127.0.0.1:'+ str(self.server_port)
-        signal.signal(signal.SIGINT, self.shutdown)
-        # Start a thread for user inputs.
-        self.user_input_thread = threading.Thread(target=self.serve_user_input)
-        self.user_input_thread.start()
+        # A persistent session keeps connections to the server alive between requests.
+        # Only connection failures and gateway errors on idempotent requests are retried,
+        # so a POST is never sent twice.
+        retry = Retry(total=RETRIES, read=0, backoff_factor=0.1, status_forcelist=(502, 503, 504))
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=MAX_WORKERS, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+        if INTERACTIVE:
+            signal.signal(signal.SIGINT, self.shutdown)
+            # Start a thread for user inputs.
+            self.user_input_thread = threading.Thread(target=self.serve_user_input)
+            self.user_input_thread.start()
 
     def serve_user_input(self):
         """Handle any user inputs.
@@ -39,7 +66,9 @@ class client:
                             3) Get all message sent to server\n
                             4) Login\n
                             5) Register\n
-                            6) Exit\n""")
+                            6) Queue message to send in a batch\n
+                            7) Send queued messages\n
+                            8) Exit\n""")
         while True:
             user_input = input(option_string)
             try:
@@ -58,6 +87,10 @@ class client:
             elif selected_option == 5:
                 self.register_user()
             elif selected_option == 6:
+                self.send_server_message(queue=True)
+            elif selected_option == 7:
+                self.flush_messages()
+            elif selected_option == 8:
                 self.shutdown(signal.SIGINT,0)
             else:
                 print("{0} is not a valid option number.".format(selected_option))
@@ -69,6 +102,15 @@ class client:
         """Handle exiting server. Join all threads."""
         print("Exiting program")
         exit_program = True
+        if self.message_queue:
+            print("Sending {0} queued message(s) before exiting.".format(len(self.message_queue)))
+            try:
+                self.flush_messages()
+            except requests.RequestException as err:
+                print("Unable to reach server: {0}".format(err))
+            if self.message_queue:
+                print("{0} queued message(s) were not sent and will be lost.".format(len(self.message_queue)))
+        self.close()
         main_thread = threading.currentThread()
         for t in threading.enumerate():
             if t is main_thread:
@@ -77,21 +119,119 @@ class client:
             t.join()
         sys.exit(0)
 
-    def send_server_message(self):
-        """Send a message to the server."""
-        message_route = self.local_route + '/messages'
+    def close(self):
+        """Wait for outstanding requests to finish and close pooled connections."""
+        self.executor.shutdown(wait=True)
+        self.session.close()
+
+    def submit(self, fn, *args, **kwargs):
+        """Run fn(*args, **kwargs) on the client's thread pool, return a Future.
+
+        For example client.submit(client.send_message, "hello") sends a message
+        without blocking the caller.
+        """
+        return self.executor.submit(fn, *args, **kwargs)
+
+    def ping(self):
+        """Ping the server, return the response."""
+        return self.session.get(self.local_route + '/ping', timeout=self.timeout)
+
+    def register(self, email, username):
+        """Register a user, keeping the auth token on success. Return the response."""
+        dict_data = {'email':email, 'username':username}
+        raw_response = self.session.post(self.local_route + '/register', json=dict_data, timeout=self.timeout)
+        if raw_response.status_code == 201:
+            self.auth_token = raw_response.json()['auth_token']
+        return raw_response
+
+    def login(self, email):
+        """Log a user in, keeping the auth token on success. Return the response."""
+        dict_data = {'email':email}
+        raw_response = self.session.post(self.local_route + '/login', json=dict_data, timeout=self.timeout)
+        if raw_response.status_code == 200:
+            self.auth_token = raw_response.json()['auth_token']
+        return raw_response
+
+    def send_message(self, message, auth_token=None):
+        """Send a single message, return the response."""
+        dict_data = {'message':message, 'auth_token':auth_token or self.auth_token}
+        return self.session.post(self.local_route + '/messages', json=dict_data, timeout=self.timeout)
+
+    def send_messages(self, messages, auth_token=None):
+        """Send a list of messages in one request, return the response."""
+        dict_data = {'messages':messages, 'auth_token':auth_token or self.auth_token}
+        return self.session.post(self.local_route + '/messages/batch', json=dict_data, timeout=self.timeout)
+
+    def fetch_messages(self, auth_token=None):
+        """Fetch all messages stored on the server, return the response.
+
+        The ETag of the last listing is sent along, so the server answers 304
+        with no body when no message has arrived since; message_listing keeps
+        the ETag and body of the last listing received.
+        """
+        dict_data = {'auth_token':auth_token or self.auth_token}
+        etag, _ = self.message_listing
+        headers = {'If-None-Match': etag} if etag else {}
+        raw_response = self.session.get(self.local_route + '/allmessages', json=dict_data,
+                                        headers=headers, timeout=self.timeout)
+        if raw_response.status_code == 200 and 'ETag' in raw_response.headers:
+            self.message_listing = (raw_response.headers['ETag'], raw_response.text)
+        return raw_response
+
+    def search_messages(self, query, page=1, per_page=20, auth_token=None):
+        """Search messages stored on the server, return the response."""
+        dict_data = {'auth_token':auth_token or self.auth_token}
+        params = {'q':query, 'page':page, 'per_page':per_page}
+        return self.session.get(self.local_route + '/search', json=dict_data, params=params, timeout=self.timeout)
+
+    def queue_message(self, message):
+        """Queue a message to be sent with the next batch, flushing once batch_size are queued."""
+        self.message_queue.append(message)
+        if len(self.message_queue) >= self.batch_size:
+            self.flush_messages()
+
+    def flush_messages(self):
+        """Send all queued messages to the server in batches of batch_size.
+
+        ## Returns:
+        The ids assigned to the sent messages. Messages of a rejected batch stay queued.
+        """
+        ids = []
+        while self.message_queue:
+            batch = self.message_queue[:self.batch_size]
+            raw_response = self.send_messages(batch)
+            if raw_response.status_code != 201:
+                # Error pages such as 413 or 5xx responses are not necessarily JSON.
+                if raw_response.headers.get('Content-Type', '').startswith('application/json'):
+                    print(raw_response.json()['message'])
+                else:
+                    print("Batch rejected by server with status {0}.".format(raw_response.status_code))
+                break
+            json_response = raw_response.json()
+            del self.message_queue[:len(batch)]
+            ids.extend(json_response['ids'])
+            print("Sent {0} message(s) with ids {1}.".format(len(batch), json_response['ids']))
+        return ids
+
+    def send_server_message(self, queue=False):
+        """Send a message to the server.
+
+        If queue is True the message is held back and sent with the next batch,
+        the queue is flushed automatically once it holds batch_size messages.
+        """
         message = input("Please enter the message you'd like to send, followed by enter.")
-        dict_data = {'message':message, 'auth_token':self.auth_token}
-        raw_response = requests.post(message_route, json=dict_data)
+        if queue:
+            self.queue_message(message)
+            print("{0} message(s) waiting in queue.".format(len(self.message_queue)))
+            return
+        raw_response = self.send_message(message)
         print(json.dumps(raw_response.text, indent=2))
         print("Message sent.")
-    
+
     def log_user_in(self):
         """Log user into server."""
-        login_route = self.local_route + '/login'
         email = input("Please enter the email address you registered with.")
-        dict_data = {'email':email}
-        raw_response = requests.post(login_route, json=dict_data)
+        raw_response = self.login(email)
         json_response = raw_response.json()
         # If sucessful login, return.
         if raw_response.status_code == 200:
@@ -113,37 +253,29 @@ class client:
 
     def register_user(self):
         """Register user into server."""
-        register_route = self.local_route + '/register'
         email = input("Please enter the email address you would like to register with.")
         username = input("Please enter the username you would like to register with:")
-        dict_data = {'email':email, 'username':username}
-        raw_response = requests.post(register_route, json=dict_data)
-        json_response = raw_response.json()
-        if raw_response.status_code == 201:
-            print(json_response['message'])
-            self.auth_token = json_response['auth_token']
-            return
-        else:
-            print(json_response['message'])
-
-
+        raw_response = self.register(email, username)
+        print(raw_response.json()['message'])
 
     def get_message_dump(self):
         """Get message dump from server."""
-        message_dump_route = self.local_route + '/allmessages'
-        raw_response = requests.get(url=message_dump_route, json={'auth_token':self.auth_token})
+        raw_response = self.fetch_messages()
         print("Message dump:")
-        print(json.dumps(raw_response.text, indent=2))
+        if raw_response.status_code == 304:
+            print("No new messages since last fetch.")
+            print(json.dumps(self.message_listing[1], indent=2))
+        else:
+            print(json.dumps(raw_response.text, indent=2))
 
     def ping_server(self):
         """Ping server."""
-        ping_route = self.local_route + '/ping'
-        raw_response = requests.get(url=ping_route)
-        # response = raw_response.json()
+        raw_response = self.ping()
         print(json.dumps(raw_response.text, indent=2))
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("-p", "--port_num", type=int, default=5000, help="Port number server is connected to.")
+    parser.add_argument("-b", "--batch_size", type=int, default=50, help="Number of queued messages to send per batch.")
     args = parser.parse_args()
-    client(args.port_num)
\ No newline at end of file
+    client(args.port_num, args.batch_size)
\ No newline at end of file
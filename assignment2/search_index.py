@@ -0,0 +1,161 @@
+"""Inverted full-text index over the messages of the messaging application."""
+import re
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Dict, List
+
+TOKEN_PATTERN = re.compile(r"\w+")
+QUERY_PATTERN = re.compile(r'"([^"]*)"|(\S+)')
+# Number of ids of the shortest posting list intersected at once, the chunk
+# doubles from MIN_CHUNK_LEN up to MAX_CHUNK_LEN as a query keeps scanning.
+MIN_CHUNK_LEN = 64
+MAX_CHUNK_LEN = 4096
+# Probe a posting list by binary search instead of slicing it when the slice
+# would be this many times larger than the remaining candidates.
+PROBE_RATIO = 8
+
+
+def tokenize(text):
+    """Split text into lower case word tokens."""
+    return [token.lower() for token in TOKEN_PATTERN.findall(text)]
+
+
+def parse_query(query):
+    """Split a query into its terms and its quoted phrases.
+
+    ## Parameters:
+    query - A query such as 'hello "good morning"'
+    ## Returns:
+    terms - Every distinct token in the query, all must match
+    phrases - Token lists of the quoted phrases, each must appear in order
+    """
+    terms: List[str] = []
+    phrases: List[List[str]] = []
+    for phrase, word in QUERY_PATTERN.findall(query):
+        tokens = tokenize(phrase if phrase else word)
+        if phrase and len(tokens) > 1:
+            phrases.append(tokens)
+        for token in tokens:
+            if token not in terms:
+                terms.append(token)
+    return terms, phrases
+
+
+def contains_id(postings, message_id, lo, hi):
+    """Check whether message_id is in postings[lo:hi] by binary search."""
+    pos = bisect_left(postings, message_id, lo, hi)
+    return pos < hi and postings[pos] == message_id
+
+
+def contains_phrase(tokens, phrase):
+    """Check whether the phrase tokens appear consecutively in tokens."""
+    length = len(phrase)
+    return any(tokens[i:i + length] == phrase for i in range(len(tokens) - length + 1))
+
+
+class search_index:
+    """Map each token to the ids of the messages containing it.
+
+    Posting lists are arrays of unsigned 32-bit message ids, appended in id
+    order so they stay sorted and can be intersected with binary search.
+    """
+
+    def __init__(self):
+        """Initialize an empty index."""
+        self.postings: Dict[str, array] = {}
+        self.last_id = 0
+        self.lock = threading.Lock()
+
+    def add(self, message_id, message):
+        """Index a message, ids must be added in increasing order."""
+        for token in set(tokenize(message)):
+            postings = self.postings.get(token)
+            if postings is None:
+                postings = self.postings[token] = array('I')
+            postings.append(message_id)
+        self.last_id = message_id
+
+    def catch_up(self, store):
+        """Index every message in the store added since the last one indexed.
+
+        The first call builds the whole index from the stored messages, later
+        calls pick up messages stored since, including by other workers.
+        """
+        with self.lock:
+            for message_id, message in store.messages_since(self.last_id):
+                self.add(message_id, message)
+
+    def search(self, query, store, offset=0, limit=20):
+        """Find the messages matching every term and phrase of a query, newest first.
+
+        ## Parameters:
+        query - Words to match, with "quoted phrases" matched in order
+        store - The message store, used to check phrases and fetch results
+        offset - Number of matches to skip
+        limit - Maximum number of matches to return
+        ## Returns:
+        results - A list of (id, message) tuples
+        has_more - Whether there are further matches after these
+        """
+        terms, phrases = parse_query(query)
+        if not terms:
+            return [], False
+        lists = [self.postings.get(term) for term in terms]
+        if not all(lists):
+            return [], False
+        results = []
+        skipped = 0
+        for message_id in self.intersect(lists):
+            message = None
+            if phrases:
+                message = store.get_message(message_id)
+                tokens = tokenize(message)
+                if not all(contains_phrase(tokens, phrase) for phrase in phrases):
+                    continue
+            if skipped < offset:
+                skipped += 1
+                continue
+            if len(results) == limit:
+                return results, True
+            results.append((message_id, message if message is not None else store.get_message(message_id)))
+        return results, False
+
+    def intersect(self, lists):
+        """Yield the ids present in every posting list, newest first.
+
+        The shortest list is walked from newest to oldest in growing chunks,
+        each intersected with the matching slice of the other lists, so the
+        first page of results stops after touching only the newest ids.
+        """
+        lists = sorted(lists, key=len)
+        if len(lists) == 1:
+            yield from reversed(lists[0])
+            return
+        shortest, others = lists[0], lists[1:]
+        upper_bounds = [len(postings) for postings in others]
+        end = len(shortest)
+        chunk_len = MIN_CHUNK_LEN
+        while end > 0:
+            start = max(0, end - chunk_len)
+            chunk = shortest[start:end]
+            candidates = set(chunk)
+            for i, postings in enumerate(others):
+                # Later chunks only hold smaller ids, so each slice ends where the last began.
+                lo = bisect_left(postings, chunk[0], 0, upper_bounds[i])
+                hi = bisect_right(postings, chunk[-1], lo, upper_bounds[i])
+                upper_bounds[i] = lo
+                if hi - lo > PROBE_RATIO * len(candidates):
+                    # A much denser list is cheaper to probe than to slice.
+                    candidates = {message_id for message_id in candidates
+                                  if contains_id(postings, message_id, lo, hi)}
+                else:
+                    candidates.intersection_update(postings[lo:hi])
+                if not candidates:
+                    break
+            yield from sorted(candidates, reverse=True)
+            if 0 in upper_bounds:
+                # A posting list has no smaller ids left to match.
+                return
+            end = start
+            chunk_len = min(chunk_len * 2, MAX_CHUNK_LEN)
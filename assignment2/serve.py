@@ -0,0 +1,88 @@
+"""Production entry point for the messaging application server.
+
+Runs app.py under gunicorn with multiple worker processes. Workers share the
+SQLite message store, since the in-memory store is private to each process.
+
+The app is preloaded, so the search index is built once in the master process
+and inherited copy-on-write by every worker, rather than each worker indexing
+every stored message itself. Each worker still indexes new messages on its own,
+so index memory grows with the worker count as messages arrive.
+"""
+import argparse
+import os
+import sys
+
+try:
+    from gunicorn.app.base import BaseApplication
+except ImportError:
+    BaseApplication = None
+
+
+def parse_args(argv=None):
+    """Parse command line arguments, defaulting to environment variables where set."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default=os.getenv('HOST', '127.0.0.1'), help="Address to bind to.")
+    parser.add_argument("-p", "--port_num", type=int, default=int(os.getenv('PORT', 5000)), help="Port number to listen on.")
+    parser.add_argument("-w", "--workers", type=int, default=int(os.getenv('WORKERS', (os.cpu_count() or 1) * 2 + 1)),
+                        help="Number of worker processes.")
+    parser.add_argument("-t", "--threads", type=int, default=int(os.getenv('THREADS', 4)),
+                        help="Number of request threads per worker.")
+    parser.add_argument("--keep_alive", type=int, default=int(os.getenv('KEEP_ALIVE', 5)),
+                        help="Seconds to hold an idle keep-alive connection open.")
+    parser.add_argument("--max_request_size", type=int, default=int(os.getenv('MAX_CONTENT_LENGTH', 1024 * 1024)),
+                        help="Maximum request body size in bytes.")
+    parser.add_argument("--max_request_line", type=int, default=int(os.getenv('MAX_REQUEST_LINE', 4094)),
+                        help="Maximum size of the HTTP request line in bytes.")
+    parser.add_argument("--db_path", default=os.getenv('DATABASE_PATH', 'messages.db'),
+                        help="SQLite database shared by all workers.")
+    return parser.parse_args(argv)
+
+
+if BaseApplication is not None:
+    class gunicorn_app(BaseApplication):
+        """Gunicorn application configured from a dict of settings."""
+
+        def __init__(self, options):
+            """Store the gunicorn settings to apply on load."""
+            self.options = options
+            super().__init__()
+
+        def load_config(self):
+            """Apply the stored settings to the gunicorn config."""
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            """Import the Flask app, building the search index before workers are forked."""
+            from app import app, message_index, store
+            if self.cfg.preload_app:
+                message_index.catch_up(store)
+                # SQLite connections must not be shared with forked workers.
+                store.close()
+            return app
+
+
+def main(argv=None):
+    """Configure the environment for the app and start gunicorn."""
+    args = parse_args(argv)
+    if BaseApplication is None:
+        print("gunicorn is not installed, install it with 'pip install gunicorn'.")
+        sys.exit(1)
+    # Set before workers import app.py, so every worker opens the same store.
+    os.environ['MESSAGE_STORE'] = 'sqlite'
+    os.environ['DATABASE_PATH'] = os.path.abspath(args.db_path)
+    os.environ['MAX_CONTENT_LENGTH'] = str(args.max_request_size)
+    options = {
+        'bind': '{0}:{1}'.format(args.host, args.port_num),
+        'workers': args.workers,
+        'threads': args.threads,
+        'worker_class': 'gthread',
+        'keepalive': args.keep_alive,
+        'limit_request_line': args.max_request_line,
+        'preload_app': True,
+    }
+    gunicorn_app(options).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+"""Storage backends for users and messages of the messaging application."""
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Dict, List
+
+
+class memory_store:
+    """Store users and messages in process memory.
+
+    Only safe for a single process, every worker of a multi-process server
+    would see its own copy of the data.
+    """
+
+    def __init__(self):
+        """Initialize empty user and message databases."""
+        self.user_database: Dict[str, Dict[str, str]] = {}
+        self.message_database: List[str] = []
+        self.lock = threading.Lock()
+
+    def add_user(self, email, username):
+        """Add a user to the user database, return the new user id."""
+        with self.lock:
+            # Find max user id
+            max_id = 0
+            for tmp_email in self.user_database:
+                if self.user_database[tmp_email]['id'] > max_id:
+                    max_id = self.user_database[tmp_email]['id']
+            self.user_database[email] = {'id': max_id + 1, 'username': username}
+            return max_id + 1
+
+    def get_user(self, email):
+        """Return the user stored under the given email, or None."""
+        return self.user_database.get(email)
+
+    def add_message(self, message):
+        """Add a message to the message database, return its id."""
+        return self.add_messages([message])[0]
+
+    def add_messages(self, messages):
+        """Add a list of messages to the message database, return their ids."""
+        with self.lock:
+            first_id = len(self.message_database) + 1
+            self.message_database.extend(messages)
+            return list(range(first_id, first_id + len(messages)))
+
+    def all_messages(self):
+        """Return all messages in the order they were added."""
+        return list(self.message_database)
+
+    def close(self):
+        """Nothing to close for the in-memory store."""
+
+    def latest_message_id(self):
+        """Return the id of the most recently added message, 0 if there are none."""
+        return len(self.message_database)
+
+    def get_message(self, message_id):
+        """Return the message with the given id."""
+        return self.message_database[message_id - 1]
+
+    def messages_since(self, message_id):
+        """Return (id, message) tuples for every message added after the given id."""
+        return list(enumerate(self.message_database[message_id:], start=message_id + 1))
+
+
+class sqlite_store:
+    """Store users and messages in a SQLite database file.
+
+    Connections are kept in a pool and reused by whichever thread needs one,
+    so servers that start a thread per request do not reconnect every time.
+    SQLite handles locking between processes, so the store can be shared by
+    every worker of a server.
+    """
+
+    def __init__(self, path):
+        """Open (creating if needed) the database at the given path."""
+        self.path = path
+        self.pool = queue.LifoQueue()
+        with self.connection() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS users ("
+                         "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                         "email TEXT UNIQUE NOT NULL, "
+                         "username TEXT)")
+            conn.execute("CREATE TABLE IF NOT EXISTS messages ("
+                         "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                         "message TEXT NOT NULL)")
+
+    @contextmanager
+    def connection(self):
+        """Borrow a pooled connection for one transaction, opening one if none are free."""
+        try:
+            conn = self.pool.get_nowait()
+        except queue.Empty:
+            # Connections move between threads, but only one uses each at a time.
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+        try:
+            with conn:
+                yield conn
+        finally:
+            self.pool.put(conn)
+
+    def close(self):
+        """Close every pooled connection, e.g. before forking worker processes."""
+        while True:
+            try:
+                self.pool.get_nowait().close()
+            except queue.Empty:
+                return
+
+    def add_user(self, email, username):
+        """Add a user to the user database, return the new user id."""
+        with self.connection() as conn:
+            cursor = conn.execute("INSERT INTO users (email, username) VALUES (?, ?)", (email, username))
+            return cursor.lastrowid
+
+    def get_user(self, email):
+        """Return the user stored under the given email, or None."""
+        with self.connection() as conn:
+            row = conn.execute("SELECT id, username FROM users WHERE email = ?", (email,)).fetchone()
+        if row is None:
+            return None
+        return {'id': row[0], 'username': row[1]}
+
+    def add_message(self, message):
+        """Add a message to the message database, return its id."""
+        return self.add_messages([message])[0]
+
+    def add_messages(self, messages):
+        """Add a list of messages to the message database, return their ids."""
+        ids = []
+        with self.connection() as conn:
+            for message in messages:
+                cursor = conn.execute("INSERT INTO messages (message) VALUES (?)", (message,))
+                ids.append(cursor.lastrowid)
+        return ids
+
+    def all_messages(self):
+        """Return all messages in the order they were added."""
+        with self.connection() as conn:
+            rows = conn.execute("SELECT message FROM messages ORDER BY id").fetchall()
+        return [row[0] for row in rows]
+
+    def latest_message_id(self):
+        """Return the id of the most recently added message, 0 if there are none."""
+        with self.connection() as conn:
+            row = conn.execute("SELECT MAX(id) FROM messages").fetchone()
+        return row[0] or 0
+
+    def get_message(self, message_id):
+        """Return the message with the given id."""
+        with self.connection() as conn:
+            row = conn.execute("SELECT message FROM messages WHERE id = ?", (message_id,)).fetchone()
+        return row[0]
+
+    def messages_since(self, message_id):
+        """Return (id, message) tuples for every message added after the given id."""
+        with self.connection() as conn:
+            return conn.execute(
+                "SELECT id, message FROM messages WHERE id > ? ORDER BY id", (message_id,)).fetchall()
+
+
+def open_store(backend=None, path=None):
+    """Open the storage backend named by the arguments or the environment.
+
+    ## Parameters:
+    backend - 'memory' or 'sqlite', defaults to the MESSAGE_STORE environment variable.
+    path - Database file for the sqlite backend, defaults to the DATABASE_PATH environment variable.
+    ## Returns:
+    A memory_store or sqlite_store.
+    """
+    backend = backend or os.getenv('MESSAGE_STORE', 'memory')
+    if backend == 'memory':
+        return memory_store()
+    elif backend == 'sqlite':
+        return sqlite_store(path or os.getenv('DATABASE_PATH', 'messages.db'))
+    raise ValueError("Unknown message store '{0}'.".format(backend))